@@ -1,8 +1,39 @@
+import asyncio
+import os
 import socket
 import struct
+import signal
 import sys
 import time
 import argparse
+import logging
+import errno
+import ctypes
+import ctypes.util
+import selectors
+import threading
+import collections
+import functools
+
+try:
+    import fcntl  # Used to look up interface addresses, not available on Windows
+except ImportError:
+    fcntl = None
+
+try:
+    import mc_native  # Optional Cython receive loop, build with: python setup.py build_ext --inplace
+except ImportError:
+    mc_native = None
+
+try:
+    import mc_uring  # Optional io_uring receive loop, built by setup.py when liburing is installed
+except ImportError:
+    mc_uring = None
+
+try:
+    import uvloop  # Optional, C implemented event loop for the asyncio receive backend
+except ImportError:
+    uvloop = None
 """
 Author - Jonathan Steward
 https://twitter.com/ggjono
@@ -15,8 +46,98 @@ https://twitter.com/techexlabs
 This tool is to support testing Multicast operation over a network
 It can be used to verify existing Multicast (MC) traffic exists on a given MC address and port
 It can also be used in a ping-pong setup with two instances running either side of a MC network to send and acknowledge MC traffic over the given network
+With --mode rate the sender sends at a fixed --rate instead of waiting on acks, to measure how much MC traffic the
+network can forward, and reports loss and reordering per receiver every second
+
+For the lowest latency pin the tool with --cpu to a core on the same NUMA node as the NIC given with --iface, and point
+the NIC's RX queue IRQs at the same cores via /proc/irq/<n>/smp_affinity_list (stop irqbalance first)
 """
 
+logger = logging.getLogger("mc")
+
+# Payloads are a little endian header of packet number, perf_counter_ns send time and the sender's ack port, then
+# PREFIX and the packet number as text. The receiver acks to the ack port with ACK_PREFIX and the header echoed back
+# verbatim so the sender can measure RTT
+HEADER = struct.Struct('<QQH')
+PREFIX = b'very important data - '  # Payload prefix the receiver recognises as coming from this tool
+ACK_PREFIX = b'ack - '
+ACK_SIZE = len(ACK_PREFIX) + HEADER.size
+RTT_ALPHA = 0.125  # EWMA weight of each new RTT sample, as for TCP's SRTT
+RTT_MULTIPLIER = 4  # Keep the send interval at least this many smoothed RTTs
+ACK_DRAIN_WAIT = 0.001  # After the first ack, how long to wait for more before going back to sending
+# Socket option layouts, compiled once rather than parsing the format string every time a socket is set up
+TTL_STRUCT = struct.Struct('b')
+MREQ_STRUCT = struct.Struct('4s4s')  # struct ip_mreq: group address then local interface address
+IFREQ_STRUCT = struct.Struct('256s')  # struct ifreq, padded out for the kernel to write the address back in to
+INADDR_ANY = struct.pack('!L', socket.INADDR_ANY)
+SOCK_BUF_SIZE = 16 * 1024 * 1024  # Default SO_SNDBUF/SO_RCVBUF, kernel defaults are often ~208KiB and drop bursts
+MIN_SLEEP = 0.001  # Default floor for the send interval so acks never turn the send loop in to a busy loop
+MAX_SLEEP = 10.0  # Ceiling for the send interval while no acks are being received
+SLEEP_BACKOFF = 1.5  # EIED style growth of the send interval on a missed ack, gentler than doubling
+RECEIVE_BACKENDS = ("threads", "asyncio", "native", "io_uring")
+SEND_MODES = ("ping-pong", "rate")
+REPORT_INTERVAL = 1.0  # Seconds between rate mode loss/reordering reports
+RATE_BURST = 32  # Max packets rate mode sends back to back to catch up after falling behind its schedule
+IP_MULTICAST_ALL = getattr(socket, "IP_MULTICAST_ALL", 49)  # Linux only, not exported by python's socket module
+SIOCGIFADDR = 0x8915  # Linux ioctl to read an interface's IPv4 address
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)  # Linux >= 4.18 UDP GSO, not exported by python's socket module
+ACK_GSO_CMSG = [(socket.IPPROTO_UDP, UDP_SEGMENT, struct.pack('=H', ACK_SIZE))]  # Split GSO sends in to single acks
+SEND_BATCH = 32  # Max datagrams handed to the kernel per sendmmsg call
+SENDMMSG_MIN = 8  # Fewer acks than this go out with plain sendto, below it sendmmsg's ctypes call overhead costs more
+ADDR_CACHE_SIZE = 1024  # Max peer addresses each send/receive loop caches the sockaddr conversion of
+RECV_BATCH = 64  # Max datagrams drained from the kernel per recvmmsg call
+RECV_BUF_SIZE = 2048
+MSG_WAITFORONE = 0x10000  # recvmmsg flag: block for the first datagram only, then return what is queued
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_ubyte * 4), ("sin_zero", ctypes.c_ubyte * 8)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IOVec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+# Layout of the structures above for reading and writing their arrays through flat memoryviews, *_WORD(S) are in
+# c_uint units
+SOCKADDR_SIZE = ctypes.sizeof(_SockAddrIn)
+SOCKADDR_PORT_OFFSET = _SockAddrIn.sin_port.offset
+SOCKADDR_PORT_ADDR = struct.Struct('!H4s')  # sin_port then sin_addr, both in network byte order
+MMSGHDR_WORDS = ctypes.sizeof(_MMsgHdr) // ctypes.sizeof(ctypes.c_uint)
+NAMELEN_WORD = _MsgHdr.msg_namelen.offset // ctypes.sizeof(ctypes.c_uint)
+MSG_LEN_WORD = _MMsgHdr.msg_len.offset // ctypes.sizeof(ctypes.c_uint)
+
+
+def _load_libc():
+    """
+    Function to load libc with the batched sendmmsg/recvmmsg syscalls, these are Linux only
+    :return: libc CDLL object or None when the batched syscalls are unavailable on this platform
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
 
 def parse_args():
     """
@@ -37,40 +158,206 @@ def parse_args():
     option_help = "use this argument to define which option you want to trigger, s/S == Send r/R == Receive e.g -o/--option R\n "
     ttl_help = "use this argument to define the ttl of the multicast traffic sent out\nDefault TTL is 20\n "
     timeout_help = "use this argument to define a timeout for receiving an ack to the Multicast traffic\nDefault timeout is 0.2s\n "
+    workers_help = "use this argument to define how many threads drain the receive socket and send acks, they all" \
+                   " share one core if --cpu is given\nDefault workers is 1\n "
+    sndbuf_help = "use this argument to define the send socket buffer size in bytes\nDefault is 16MiB, capped by net.core.wmem_max\n "
+    rcvbuf_help = "use this argument to define the receive socket buffer size in bytes\nDefault is 16MiB, capped by net.core.rmem_max\n "
+    min_interval_help = "use this argument to define the shortest interval in seconds between sent MC packets\nDefault is 0.001s\n "
+    loopback_help = "use this argument to loop sent MC traffic back to this host, e.g. to test with both ends on one box\n "
+    iface_help = "use this argument to define the name (Linux only), IP address or hostname of the local interface to" \
+                 " send and receive MC traffic on\nDefault is to let the routing table pick\n "
+    cpu_help = "use this argument to pin the tool to a CPU, ideally one on the NIC's NUMA node that also handles the" \
+               " NIC's RX IRQs. Every --workers thread is pinned to the same CPU so only use it with 1 worker\n" \
+               "Default is no pinning\n "
+    backend_help = "use this argument to define how the receiver drains the socket, threads == recvmmsg worker threads" \
+                   " asyncio == asyncio DatagramProtocol, using uvloop if installed" \
+                   " native == C receive loop from mc_native.pyx, one per worker thread" \
+                   " io_uring == multishot recvmsg loop from mc_uring.pyx, Linux >= 6.0 with liburing, one ring per" \
+                   " worker thread\nDefault backend is threads\n "
+    mode_help = "use this argument to define how the sender paces MC traffic, ping-pong == wait for acks and adapt the" \
+                " send interval to them rate == send at a fixed --rate and count acks in the background\n" \
+                "Default mode is ping-pong\n "
+    rate_help = "use this argument to define the packets per second to send in rate mode\nDefault rate is 1000\n "
+    verbose_help = "use this argument to log every packet sent, received and acknowledged\n "
     parser.add_argument("-a", "--address", help=address_help, dest="address", default="239.1.1.1")
     parser.add_argument("-p", "--port", help=port_help, dest="port", default=10000, type=int)
-    parser.add_argument("-o", "--option", help=option_help, dest="option", required=True)
+    parser.add_argument("-o", "--option", help=option_help, dest="option", required=True, choices=list("sSrR"))
     parser.add_argument("-ttl", help=ttl_help, dest="ttl", default=20, type=int)
-    parser.add_argument("-t", "--timeout", help=timeout_help, dest="timeout", default=0.2, type=int)
+    parser.add_argument("-t", "--timeout", help=timeout_help, dest="timeout", default=0.2, type=float)
+    parser.add_argument("-w", "--workers", help=workers_help, dest="workers", default=1, type=int)
+    parser.add_argument("--sndbuf", help=sndbuf_help, dest="sndbuf", default=SOCK_BUF_SIZE, type=int)
+    parser.add_argument("--rcvbuf", help=rcvbuf_help, dest="rcvbuf", default=SOCK_BUF_SIZE, type=int)
+    parser.add_argument("--min-interval", help=min_interval_help, dest="min_interval", default=MIN_SLEEP, type=float)
+    parser.add_argument("--loopback", help=loopback_help, dest="loopback", action="store_true")
+    parser.add_argument("-i", "--iface", help=iface_help, dest="iface", default=None)
+    parser.add_argument("--cpu", help=cpu_help, dest="cpu", default=None, type=int)
+    parser.add_argument("--backend", help=backend_help, dest="backend", default="threads", choices=RECEIVE_BACKENDS)
+    parser.add_argument("--mode", help=mode_help, dest="mode", default="ping-pong", choices=SEND_MODES)
+    parser.add_argument("--rate", help=rate_help, dest="rate", default=1000.0, type=float)
+    parser.add_argument("-v", "--verbose", help=verbose_help, dest="verbose", action="store_true")
     arguments = parser.parse_args()
+    if arguments.rate <= 0:
+        parser.error("--rate must be above 0")
+    # Resolved once here so a bad --iface is a usage error rather than a traceback from the first socket using it
+    arguments.iface_addr = None
+    if arguments.iface is not None:
+        try:
+            arguments.iface_addr = resolve_iface(arguments.iface)
+        except (ValueError, OSError) as err:
+            parser.error("can't resolve --iface {}: {}".format(arguments.iface, err))
     return arguments
 
 
-def form_sock_send(timeout, ttl):
+def set_sock_buf(sock, option, size, sysctl):
+    """
+    Function to set a socket buffer size and warn if the kernel did not honour it
+    :param sock: Socket object to set the buffer size on
+    :param option: socket.SO_SNDBUF or socket.SO_RCVBUF
+    :param size: Requested buffer size in bytes
+    :param sysctl: Name of the sysctl capping this buffer, used in the warning
+    :return:
+    """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+    except OSError as err:
+        # BSDs and macOS refuse anything over kern.ipc.maxsockbuf outright rather than capping it
+        logger.warning("Can't set socket buffer to %d bytes (%s), keeping the default. Raise %s or "
+                       "kern.ipc.maxsockbuf to allow bigger buffers", size, err, sysctl)
+        return
+    actual = sock.getsockopt(socket.SOL_SOCKET, option)
+    if sys.platform.startswith("linux"):
+        # Linux doubles the value it grants to allow for bookkeeping overhead and reports that back, so halve it to
+        # compare with what was asked for, e.g. a 16MiB request capped at 8MiB reads back as 16MiB
+        actual //= 2
+    if actual < size:
+        logger.warning("Socket buffer capped at %d bytes instead of %d, raise %s to allow bigger buffers",
+                       actual, size, sysctl)
+
+
+def _iface_names():
+    """
+    Function to list the local interface names, for matching against --iface
+    :return: List of interface names, empty where the platform can't list or look them up
+    """
+    # SIOCGIFADDR is Linux's ioctl number, BSDs and macOS have fcntl and if_nameindex but number it differently
+    if not sys.platform.startswith("linux") or fcntl is None or not hasattr(socket, "if_nameindex"):
+        return []
+    return [name for _, name in socket.if_nameindex()]
+
+
+def _iface_addr(name):
+    """
+    Function to look up the IPv4 address of an interface by name
+    :param name: Interface name e.g eth0
+    :return: 4 byte packed address, None if the interface has no IPv4 address
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            ifreq = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, IFREQ_STRUCT.pack(name.encode()[:15]))
+        except OSError:
+            return None
+    # ifreq is the 16 byte name then a sockaddr_in, the address sits after its family and port
+    return ifreq[20:24]
+
+
+def resolve_iface(iface):
+    """
+    Function to resolve the --iface argument to the packed IPv4 address socket options expect
+    :param iface: Interface name, dotted quad IPv4 address or hostname of the local interface, None for any interface
+    :return: 4 byte packed address, INADDR_ANY if iface is None
+    """
+    if iface is None:
+        return INADDR_ANY
+    if iface in _iface_names():
+        addr = _iface_addr(iface)
+        if addr is None:
+            raise ValueError("Interface {} has no IPv4 address".format(iface))
+        return addr
+    try:
+        return socket.inet_aton(iface)
+    except OSError:
+        return socket.inet_aton(socket.getaddrinfo(iface, None, socket.AF_INET)[0][4][0])
+
+
+def pin_to_cpu(cpu, iface_addr=None):
+    """
+    Function to pin this process to a CPU and warn if that CPU is on a different NUMA node to the NIC, as handing
+    packets between the NIC's node and a remote one adds latency to every packet
+    :param cpu: CPU number to pin to
+    :param iface_addr: Packed address of the --iface interface from resolve_iface, used to find the NIC's NUMA node
+    :return:
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        logger.warning("CPU pinning isn't supported on this platform, ignoring --cpu")
+        return
+    # Pinned before any worker threads are started so they inherit it
+    try:
+        os.sched_setaffinity(0, {cpu})
+    except OSError as err:
+        sys.exit("Can't pin to CPU {}: {}".format(cpu, err))
+    if iface_addr is None:
+        return
+    name = next((name for name in _iface_names() if _iface_addr(name) == iface_addr), None)
+    if name is None:
+        return
+    try:
+        with open("/sys/class/net/{}/device/numa_node".format(name)) as numa_file:
+            node = int(numa_file.read())
+    except (OSError, ValueError):
+        return  # Virtual interfaces have no device to read a NUMA node from
+    # Single node machines report -1
+    if node >= 0 and not os.path.exists("/sys/devices/system/cpu/cpu{}/node{}".format(cpu, node)):
+        logger.warning("CPU %d isn't on %s's NUMA node %d, expect higher latency. Pin to a CPU on node %d and point "
+                       "the NIC's IRQs at it via /proc/irq/<n>/smp_affinity_list", cpu, name, node, node)
+
+
+def form_sock_send(ttl, sndbuf=SOCK_BUF_SIZE, loopback=False, iface_addr=None):
     """
     Function to form the Network socket to send Multicast traffic
-    :param timeout: How long to keep open waiting for an ACK to the MC traffic
     :param ttl: The TTL value to set when sending MC traffic
+    :param sndbuf: Send socket buffer size in bytes
+    :param loopback: Whether sent MC traffic is looped back to this host as well as sent to the network
+    :param iface_addr: Packed address of the interface to send MC traffic out of from resolve_iface, None to use the
+        routing table
     :return: Sock object ready for the send function
     """
     # Create the datagram socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    # Set a timeout so the socket does not block indefinitely when trying to receive data, default - 0.2
-    # to receive data.
-    sock.settimeout(timeout)
-
     # Set the time-to-live for messages to control number of L3 hops for traffic to propigate over default - 20.
-    ttl = struct.pack('b', ttl)
+    ttl = TTL_STRUCT.pack(ttl)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+
+    # Don't have the kernel copy every packet back to this host unless asked to
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(loopback))
+    set_sock_buf(sock, socket.SO_SNDBUF, sndbuf, "net.core.wmem_max")
+
+    # Pin the outgoing interface once here so the kernel doesn't need to pick one from the routing table per send
+    if iface_addr is not None:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, iface_addr)
+    return sock
+
+
+def form_sock_ack(iface_addr=None):
+    """
+    Function to create the socket acks to sent MC traffic come back on, kept apart from the send socket so waiting
+    for acks can be driven by a selector
+    :param iface_addr: Packed address of the interface to receive acks on from resolve_iface, None for all interfaces
+    :return: Non blocking sock object bound to an ephemeral port
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((socket.inet_ntoa(iface_addr or INADDR_ANY), 0))
+    sock.setblocking(False)
     return sock
 
 
-def form_sock_receive(group, port):
+def form_sock_receive(group, port, rcvbuf=SOCK_BUF_SIZE, iface_addr=None):
     """
     Function to create socket to receive MC traffic for a specific group on a specific port
     :param group: Multicast Group to receive traffic on
     :param port:  Port To receive traffic on, this should match the sending port
+    :param rcvbuf: Receive socket buffer size in bytes
+    :param iface_addr: Packed address of the interface to join the group on from resolve_iface, None for all interfaces
     :return:
     """
     server_address = ('', port)
@@ -78,113 +365,617 @@ def form_sock_receive(group, port):
     # Create the socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
+    # Allow other receivers on this host to bind the same port, e.g. several instances listening on different groups
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # Linux otherwise hands a socket bound to '' traffic for every group any socket on the host joined on this port, so
+    # a receiver would ack groups it never joined. BSDs and macOS already only deliver the groups a socket joined
+    if sys.platform.startswith("linux"):
+        sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+    set_sock_buf(sock, socket.SO_RCVBUF, rcvbuf, "net.core.rmem_max")
+
     # Bind to the server address
     sock.bind(server_address)
-    # Tell the operating system to add the socket to the multicast group on all interfaces.
+    # Tell the operating system to add the socket to the multicast group on the given interface, or all interfaces.
     group = socket.inet_aton(group)
-    mreq = struct.pack('4sL', group, socket.INADDR_ANY)
+    mreq = MREQ_STRUCT.pack(group, iface_addr or INADDR_ANY)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
     return sock
 
 
-def mc_send(multicast_group, message, sock):
+def _pack_sockaddr(address):
+    """
+    Function to pack a python (host, port) tuple in to a struct sockaddr_in
+    :param address: (host, port) tuple, host must be a dotted quad IPv4 address
+    :return: SOCKADDR_SIZE bytes
+    """
+    return bytes(_SockAddrIn(socket.AF_INET, socket.htons(address[1]), tuple(socket.inet_aton(address[0]))))
+
+
+def _unpack_sockaddr(packed):
+    """
+    Function to turn the port and address bytes of a sockaddr_in back in to a python (host, port) tuple
+    :param packed: 6 bytes, the port then address both in network byte order
+    :return: (host, port) tuple
+    """
+    port, addr = SOCKADDR_PORT_ADDR.unpack(packed)
+    return socket.inet_ntoa(addr), port
+
+
+def _cached(cache, key, convert):
+    """
+    Function to convert addresses through a per loop cache, a test sees few peers so almost every lookup is a hit
+    :param cache: Dict owned by the calling loop
+    :param key: Address to convert
+    :param convert: _pack_sockaddr or _unpack_sockaddr
+    :return: Converted address
+    """
+    value = cache.get(key)
+    if value is None:
+        if len(cache) >= ADDR_CACHE_SIZE:
+            cache.clear()  # Crude bound so a flood of spoofed sources can't grow it without limit
+        value = cache[key] = convert(key)
+    return value
+
+
+def _sendmmsg_batch(vlen, msgsize):
+    """
+    Function to preallocate the structures _sendmmsg fills in so it does not build ctypes objects per call.
+    Each send loop owns its batch.
+    :param vlen: Max number of datagrams to send per call
+    :param msgsize: Size of every datagram sent with this batch, e.g. ACK_SIZE
+    :return: Batch tuple to pass to _sendmmsg, None off Linux where _sendmmsg always uses sendto
+    """
+    if _libc is None:
+        return None
+    bufs = (ctypes.c_char * msgsize * vlen)()
+    addrs = (_SockAddrIn * vlen)()
+    iovs = (_IOVec * vlen)()
+    hdrs = (_MMsgHdr * vlen)()
+    for i in range(vlen):
+        iovs[i].iov_base = ctypes.addressof(bufs[i])
+        iovs[i].iov_len = msgsize
+        hdrs[i].msg_hdr.msg_name = ctypes.addressof(addrs[i])
+        hdrs[i].msg_hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+        hdrs[i].msg_hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdrs[i].msg_hdr.msg_iovlen = 1
+    # Filled in through flat views, one slice assignment per chunk is far cheaper than setting ctypes fields
+    return vlen, msgsize, hdrs, memoryview(bufs).cast('B'), memoryview(addrs).cast('B'), {}
+
+
+def _sendmmsg(sock, msgs, batch):
+    """
+    Function to send a list of datagrams with as few syscalls as possible, uses sendmmsg on Linux when there are
+    enough datagrams for it to pay off and one sendto per datagram otherwise
+    :param sock: Socket object to send the datagrams on
+    :param msgs: List of (message bytes, (host, port)) tuples, each message exactly the batch's msgsize
+    :param batch: Preallocated batch from _sendmmsg_batch
+    :return: List of ((host, port), OSError) for the datagrams that couldn't be sent, the rest are still sent
+    """
+    failed = []
+    if batch is None or len(msgs) < SENDMMSG_MIN:
+        for message, address in msgs:
+            try:
+                sock.sendto(message, address)
+            except OSError as err:
+                failed.append((address, err))
+        return failed
+    vlen, msgsize, hdrs, buf_view, addr_view, addr_cache = batch
+    for start in range(0, len(msgs), vlen):
+        chunk = msgs[start:start + vlen]
+        buf_view[:len(chunk) * msgsize] = b"".join([message for message, _ in chunk])
+        addr_view[:len(chunk) * SOCKADDR_SIZE] = b"".join([_cached(addr_cache, address, _pack_sockaddr)
+                                                            for _, address in chunk])
+        sent = 0
+        while sent < len(chunk):
+            # sendmmsg may hand fewer datagrams to the kernel than asked, carry on from where it stopped
+            ret = _libc.sendmmsg(sock.fileno(), ctypes.byref(hdrs[sent]), len(chunk) - sent, 0)
+            if ret < 0:
+                # The error is for the first datagram not sent, skip it and carry on with the rest
+                err = ctypes.get_errno()
+                failed.append((chunk[sent][1], OSError(err, os.strerror(err))))
+                ret = 1
+            sent += ret
+    return failed
+
+
+def _recvmmsg_batch(vlen, bufsize):
+    """
+    Function to preallocate the buffers the receive loop fills in so it does not allocate per datagram.
+    Each receive loop owns its batch, the views _recvmmsg hands back are only valid until the next call on it.
+    :param vlen: Max number of datagrams to receive per call
+    :param bufsize: Size of each datagram buffer
+    :return: Batch tuple to pass to _recvmmsg
+    """
+    if _libc is None:
+        # Single reusable buffer for recvfrom_into
+        buf = bytearray(bufsize)
+        return 1, bufsize, None, memoryview(buf), None, None, None
+    bufs = (ctypes.c_char * bufsize * vlen)()
+    addrs = (_SockAddrIn * vlen)()
+    iovs = (_IOVec * vlen)()
+    hdrs = (_MMsgHdr * vlen)()
+    for i in range(vlen):
+        iovs[i].iov_base = ctypes.addressof(bufs[i])
+        iovs[i].iov_len = bufsize
+        hdrs[i].msg_hdr.msg_name = ctypes.addressof(addrs[i])
+        hdrs[i].msg_hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+        hdrs[i].msg_hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdrs[i].msg_hdr.msg_iovlen = 1
+    # Read back through flat views, slicing these is far cheaper than reading ctypes fields one by one
+    return (vlen, bufsize, hdrs, memoryview(bufs).cast('B'), memoryview(addrs).cast('B'),
+            memoryview(hdrs).cast('B').cast('I'), {})
+
+
+def _recvmmsg(sock, batch):
+    """
+    Function to receive one or more datagrams in a single syscall, blocks until at least one datagram is queued and
+    then returns everything else already queued up to the batch size
+    :param sock: Socket object to receive on
+    :param batch: Preallocated batch from _recvmmsg_batch
+    :return: List of (data memoryview, (host, port)) tuples, the views point in to the batch buffers
+    """
+    vlen, bufsize, hdrs, view, addr_view, hdr_words, addr_cache = batch
+    if hdrs is None:
+        nbytes, address = sock.recvfrom_into(view, bufsize)
+        return [(view[:nbytes], address)]
+    while True:
+        ret = _libc.recvmmsg(sock.fileno(), hdrs, vlen, MSG_WAITFORONE, None)
+        if ret >= 0:
+            break
+        err = ctypes.get_errno()
+        if err != errno.EINTR:  # Retry on EINTR so python gets a chance to run any signal handlers
+            raise OSError(err, "recvmmsg failed")
+    names = addr_view[:ret * SOCKADDR_SIZE].tobytes()
+    lengths = hdr_words[MSG_LEN_WORD:ret * MMSGHDR_WORDS:MMSGHDR_WORDS].tolist()
+    received = []
+    for i in range(ret):
+        offset = i * SOCKADDR_SIZE + SOCKADDR_PORT_OFFSET
+        address = _cached(addr_cache, names[offset:offset + SOCKADDR_PORT_ADDR.size], _unpack_sockaddr)
+        received.append((view[i * bufsize:i * bufsize + lengths[i]], address))
+        # The kernel overwrote msg_namelen with the length it wrote, reset it for the next call
+        hdr_words[i * MMSGHDR_WORDS + NAMELEN_WORD] = SOCKADDR_SIZE
+    return received
+
+
+def mc_send(multicast_group, message, sock, selector, timeout):
     """
     Function to send Multicast traffic from local host to the network based on a given MC group and port with a given text message
     :param multicast_group: MC Group to send traffic to
-    :param message: Text to send out in the MC traffic
+    :param message: Payload to send out in the MC traffic, starting with HEADER
     :param sock: Socket object to use when sending traffic.
-    :return: True/False based on if an Ack has been received or not.
+    :param selector: Selector with the ack socket from form_sock_ack registered for reading
+    :param timeout: How long to wait for the first ACK to the MC traffic
+    :return: RTT in seconds of the last ack received, None if no Ack has been received.
     """
-    received_ack = False
-    try:
-        # Send data to the multicast group
-        print(sys.stderr, 'sending "%s"' % message)
-        sock.sendto(message, multicast_group)
+    rtt = None
+    # Checked once per packet so the per-packet log lines cost nothing unless --verbose is set
+    debug = logger.isEnabledFor(logging.DEBUG)
+    # Send data to the multicast group
+    if debug:
+        logger.debug("sending %r", bytes(message[HEADER.size:]))
+    sock.sendto(message, multicast_group)
 
-        # Look for responses from all recipients
-        while True:
-            print(sys.stderr, 'waiting to receive')
+    # Look for responses from all recipients, waiting up to timeout for the first then only as long as more keep coming
+    events = selector.select(timeout)
+    if not events and debug:
+        logger.debug("timed out, no responses")
+    while events:
+        for key, _ in events:
             try:
-                data, server = sock.recvfrom(16)
-            except socket.timeout:
-                print(sys.stderr, 'timed out, no more responses')
-                return received_ack
-            else:
-                print(sys.stderr, 'received "%s" from %s' % (data, server))
-                received_ack = True
-    except:
-        print(sys.stderr, 'closing socket')
-        sock.close()
-        sys.exit()
+                data, server = key.fileobj.recvfrom(64)
+            except BlockingIOError:
+                continue
+            if len(data) != ACK_SIZE or not data.startswith(ACK_PREFIX):
+                continue
+            # The echoed send time also gives a valid RTT for late acks to earlier packets
+            packet_no, sent_ns, _ = HEADER.unpack_from(data, len(ACK_PREFIX))
+            rtt = (time.perf_counter_ns() - sent_ns) / 1e9
+            if debug:
+                logger.debug("received ack %d from %s, rtt %.6fs", packet_no, server, rtt)
+        events = selector.select(ACK_DRAIN_WAIT)
+    return rtt
 
 
-def loop_sending_mc(group, port, timeout, ttl):
+def loop_sending_mc(group, port, timeout, ttl, sndbuf=SOCK_BUF_SIZE, loopback=False, min_interval=MIN_SLEEP,
+                    iface_addr=None):
     """
     Function to loop sending MC traffic with ability to speed up or slow down based on if we receive acknowledgements
     :param group: Multicast group to send traffic to
     :param port: Port to send Multicast traffic on
     :param timeout: Timeout specifying how long to keep the port open waiting for an acknowledgement
     :param ttl: Time to live value set on the MC packet sent out onto the network. Defines #of L3 hops till packet dies
+    :param sndbuf: Send socket buffer size in bytes
+    :param loopback: Whether sent MC traffic is looped back to this host as well as sent to the network
+    :param min_interval: Shortest interval in seconds between sent MC packets
+    :param iface_addr: Packed address of the interface to send MC traffic out of from resolve_iface, None to use the
+        routing table
     :return:
     """
-    multicast_group = (group, port)
+    # Resolve the group once up front rather than leaving sendto to parse the address string on every packet
+    multicast_group = socket.getaddrinfo(group, port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
     loop = True
     num_sent = 0
-    message = 'very important data - {}'
     sleep = 2.0 #Default sleep for 2s for MC packets
-    sock = form_sock_send(timeout, ttl)
-    while loop:
-        message_no = message.format(num_sent)
-        message_bytes = str.encode(message_no)
-        if mc_send(multicast_group, message_bytes, sock):
-            sleep = sleep/2
-            #Reduce the sleep value to support more/quicker received packets
-        else:
-            sleep = min(max(1.0, (sleep*2)), 10.0)
-            #Doubling sleep period to a max value of 10 sec in case of no received ack's
-            #Min to ensure we don't keep doubling to a stupid sleep value
-            #Max to ensure after successful Ack's stop being recieved the script will set sleep to 1s by default
-            #Otherwise script would not sleep at all when seeing failures after a success
-        num_sent += 1
-        if sleep >= 1:
-            print("sleeping for {}s".format(sleep))
-        time.sleep(sleep)
-        print("sent {} MC packets so far".format(num_sent))
+    rtt_avg = None
+    # Preallocated payload, the header and packet number are written in to it in place for each packet
+    text_offset = HEADER.size + len(PREFIX)
+    payload = bytearray(text_offset + 20)  # 20 digits fits any 64 bit packet number
+    payload[HEADER.size:text_offset] = PREFIX
+    payload_view = memoryview(payload)
+    # Closed by the with blocks when the SIGINT handler exits
+    with form_sock_send(ttl, sndbuf, loopback, iface_addr) as sock, form_sock_ack(iface_addr) as ack_sock, \
+            selectors.DefaultSelector() as selector:
+        selector.register(ack_sock, selectors.EVENT_READ)
+        ack_port = ack_sock.getsockname()[1]
+        # Pace sends against a monotonic deadline so time spent waiting for acks and OS jitter don't add up over a run
+        next_deadline = time.monotonic()
+        while loop:
+            packet_no = str(num_sent).encode('ascii')
+            end = text_offset + len(packet_no)
+            payload[text_offset:end] = packet_no
+            HEADER.pack_into(payload, 0, num_sent, time.perf_counter_ns(), ack_port)
+            rtt = mc_send(multicast_group, payload_view[:end], sock, selector, timeout)
+            if rtt is not None:
+                rtt_avg = rtt if rtt_avg is None else (1 - RTT_ALPHA) * rtt_avg + RTT_ALPHA * rtt
+                sleep = min(max(sleep * 0.5, rtt_avg * RTT_MULTIPLIER, min_interval), MAX_SLEEP)
+                #Reduce the sleep value to support more/quicker received packets
+                #Floored so repeated halving can't shrink it to nothing and spin the loop, and so the send
+                #rate backs off as the network's RTT grows rather than only once acks are missed outright
+            else:
+                sleep = min(max(1.0, (sleep * SLEEP_BACKOFF)), MAX_SLEEP)
+                #Growing sleep period to a max value of 10 sec in case of no received ack's
+                #Min to ensure we don't keep doubling to a stupid sleep value
+                #Max to ensure after successful Ack's stop being recieved the script will set sleep to 1s by default
+                #Otherwise script would not sleep at all when seeing failures after a success
+            num_sent += 1
+            if sleep >= 1:
+                logger.info("sleeping for %ss", sleep)
+            next_deadline += sleep
+            delay = next_deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_deadline = time.monotonic()  # Fell behind, e.g. the ack wait outlasted sleep, so don't try to catch up
+            logger.debug("sent %d MC packets so far", num_sent)
+
+
+def loop_rate_mc(group, port, rate, ttl, sndbuf=SOCK_BUF_SIZE, loopback=False, iface_addr=None):
+    """
+    Function to send MC traffic at a fixed rate, acks are counted by a background thread so the send rate isn't tied
+    to the RTT the way loop_sending_mc's is
+    :param group: Multicast group to send traffic to
+    :param port: Port to send Multicast traffic on
+    :param rate: Packets per second to send
+    :param ttl: Time to live value set on the MC packet sent out onto the network. Defines #of L3 hops till packet dies
+    :param sndbuf: Send socket buffer size in bytes
+    :param loopback: Whether sent MC traffic is looped back to this host as well as sent to the network
+    :param iface_addr: Packed address of the interface to send MC traffic out of from resolve_iface, None to use the
+        routing table
+    :return:
+    """
+    multicast_group = socket.getaddrinfo(group, port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+    interval = 1.0 / rate
+    sent = [0]  # Shared with the ack thread, which only reads it
+    stop = threading.Event()
+    text_offset = HEADER.size + len(PREFIX)
+    payload = bytearray(text_offset + 20)
+    payload[HEADER.size:text_offset] = PREFIX
+    payload_view = memoryview(payload)
+    with form_sock_send(ttl, sndbuf, loopback, iface_addr) as sock, form_sock_ack(iface_addr) as ack_sock:
+        ack_port = ack_sock.getsockname()[1]
+        ack_thread = threading.Thread(target=_count_acks, args=(ack_sock, sent, stop), daemon=True)
+        ack_thread.start()
+        try:
+            # Token bucket pacing, each packet is due interval after the last one was due rather than after it was sent
+            next_send = time.monotonic()
+            while True:
+                num_sent = sent[0]
+                packet_no = str(num_sent).encode('ascii')
+                end = text_offset + len(packet_no)
+                payload[text_offset:end] = packet_no
+                HEADER.pack_into(payload, 0, num_sent, time.perf_counter_ns(), ack_port)
+                sock.sendto(payload_view[:end], multicast_group)
+                sent[0] = num_sent + 1
+                next_send += interval
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -RATE_BURST * interval:
+                    next_send = time.monotonic()  # Too far behind to catch up with a short burst, drop the backlog
+        finally:
+            stop.set()
+            ack_thread.join()
+
+
+def _count_acks(ack_sock, sent, stop):
+    """
+    Function to count the acks to rate mode MC traffic and log loss and reordering per receiver every REPORT_INTERVAL
+    :param ack_sock: Socket from form_sock_ack the acks come back on
+    :param sent: One item list holding the number of MC packets sent so far
+    :param stop: threading.Event set by the send loop when it exits
+    :return:
+    """
+    acked = collections.Counter()  # Acks received per receiver
+    reordered = collections.Counter()  # Acks per receiver that arrived after an ack to a later packet
+    first = {}  # Lowest packet number acked per receiver, so a receiver started mid run isn't blamed for earlier ones
+    highest = {}  # Highest packet number acked per receiver
+    buf = bytearray(64)
+    last_acked = collections.Counter()
+    last_sent = 0
+    last_report = time.monotonic()
+    next_report = last_report + REPORT_INTERVAL
+    while not stop.is_set():
+        # A timeout of 0 would make the socket non blocking, so always wait a little even once the report is due
+        ack_sock.settimeout(max(ACK_DRAIN_WAIT, next_report - time.monotonic()))
+        try:
+            n, server = ack_sock.recvfrom_into(buf)
+        except socket.timeout:
+            n = 0
+        if n == ACK_SIZE and buf.startswith(ACK_PREFIX):
+            packet_no = HEADER.unpack_from(buf, len(ACK_PREFIX))[0]
+            acked[server] += 1
+            if packet_no < highest.get(server, -1):
+                reordered[server] += 1
+            else:
+                highest[server] = packet_no
+            if packet_no < first.get(server, packet_no + 1):
+                first[server] = packet_no
+        now = time.monotonic()
+        if now < next_report or stop.is_set():
+            continue
+        # Timed on the clock rather than assumed to be REPORT_INTERVAL, the process may have been stalled or stopped
+        elapsed = now - last_report
+        num_sent = sent[0]
+        logger.info("sent %d MC packets, %d in the last %.1fs", num_sent, num_sent - last_sent, elapsed)
+        if not acked:
+            logger.info("no acks received")
+        for server, count in acked.items():
+            # Packets sent before the last report have had at least REPORT_INTERVAL to be acked so any still missing
+            # are lost, later ones past the highest acked may still be in flight. Counting against last_sent as well
+            # as highest means a receiver that stops acking shows its loss growing rather than stuck
+            expected = max(highest[server] + 1, last_sent) - first[server]
+            lost = max(0, expected - count)
+            logger.info("%s: %d acks in the last %.1fs, %d lost (%.2f%%), %d out of order", server,
+                        count - last_acked[server], elapsed, lost, 100.0 * lost / max(1, expected), reordered[server])
+        last_acked = acked.copy()
+        last_sent = num_sent
+        last_report = now
+        next_report += REPORT_INTERVAL
+        if next_report <= now:
+            next_report = now + REPORT_INTERVAL  # Missed whole reports while stalled, don't fire them back to back
 
 
-def receive_mc(group, port):
+def receive_mc(group, port, workers=1, rcvbuf=SOCK_BUF_SIZE, backend="threads", iface_addr=None):
     """
     Function to receive multicast traffic on a local device and send back an acknowledgement to the sending device
     :param group: Multicast group to receive traffic on.
     :param port: Port to receive traffic on
+    :param workers: Number of threads draining the socket, each datagram is handed to exactly one of them
+    :param rcvbuf: Receive socket buffer size in bytes
+    :param backend: One of RECEIVE_BACKENDS, how the socket is drained
+    :param iface_addr: Packed address of the interface to join the group on from resolve_iface, None for all interfaces
+    :return:
+    """
+    if backend == "native" and mc_native is None:
+        logger.warning("mc_native isn't built, falling back to the threads backend. Build it with: "
+                       "python setup.py build_ext --inplace")
+        backend = "threads"
+    if backend == "io_uring" and (mc_uring is None or not mc_uring.supported()):
+        logger.warning("mc_uring isn't built or this kernel lacks multishot recvmsg, falling back to the threads "
+                       "backend. Build it with liburing installed: python setup.py build_ext --inplace")
+        backend = "threads"
+    with form_sock_receive(group, port, rcvbuf, iface_addr) as sock:
+        if backend == "asyncio":
+            _receive_asyncio(sock)
+            return
+        # Workers share one socket, on Linux every socket joined to a group gets its own copy of each MC datagram so
+        # a socket per worker would ack every packet once per worker
+        if backend == "native":
+            # The native loop runs without the GIL so its workers drain the socket truly in parallel
+            target = mc_native.run_receive
+            target_args = (sock.fileno(), sock.fileno(), RECV_BUF_SIZE, HEADER.size, PREFIX, ACK_PREFIX)
+        elif backend == "io_uring":
+            # Each worker owns a ring, the kernel fills registered buffers and a batch of acks is one submit syscall
+            target = mc_uring.run_receive
+            target_args = (sock.fileno(), sock.fileno(), HEADER.size, PREFIX, ACK_PREFIX)
+        else:
+            target = _receive_worker
+            target_args = (sock, _gso_supported(sock))
+        threads = [threading.Thread(target=_run_worker, args=(target, target_args), daemon=True)
+                   for _ in range(max(1, workers))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # The workers only return on an error, so there is nothing left to ack MC traffic
+    logger.error("All receive workers have stopped")
+    sys.exit(1)
+
+
+def _run_worker(target, args):
+    """
+    Function to run a receive worker thread and log why it stopped, per packet errors are handled inside the workers
+    so anything reaching here e.g. the socket failing means the worker is done
+    :param target: Receive loop to run, _receive_worker or a native run_receive
+    :param args: Arguments to call target with
+    :return:
+    """
+    try:
+        target(*args)
+    except Exception:
+        logger.exception("Receive worker stopped")
+
+
+_foreign_sources = set()  # Addresses already warned about sending non mc-network-test.py traffic
+_failed_acks = set()  # Addresses already warned about acks failing to send to
+
+
+def _make_ack(data, address, debug):
+    """
+    Function to check a received datagram came from a mc-network-test.py sender and build the ack for it
+    :param data: Received datagram, bytes or memoryview
+    :param address: (host, port) the datagram came from
+    :param debug: Whether to log the datagram at DEBUG
+    :return: Tuple of ack bytes and the sender's (host, ack port) to send it to, None if the datagram isn't ours
+    """
+    if data[HEADER.size:HEADER.size + len(PREFIX)] != PREFIX:
+        # Only warn the first time so a foreign stream doesn't flood the log
+        if address not in _foreign_sources:
+            _foreign_sources.add(address)
+            logger.warning("Multicast data received isn't from the python mc-network-test.py sender!")
+            logger.warning("Some other source on address '%s' is sending traffic! Ignoring it", address)
+        return None
+    ack_address = (address[0], HEADER.unpack_from(data)[2])
+    if ack_address[1] == 0:
+        # Can't be sent to, and a sendto to port 0 fails with EINVAL
+        if address not in _foreign_sources:
+            _foreign_sources.add(address)
+            logger.warning("Multicast data from '%s' asks for acks on port 0! Ignoring it", address)
+        return None
+    if debug:
+        logger.debug("received %r from %s, sending acknowledgement to %s", bytes(data[HEADER.size:]), address,
+                     ack_address)
+    return ACK_PREFIX + data[:HEADER.size], ack_address
+
+
+def _ack_failed(address, err):
+    """
+    Function to report an ack that couldn't be sent, e.g. ENETUNREACH or a firewall's EPERM, the ack is dropped and
+    the receive loop carries on
+    :param address: (host, port) the ack was being sent to
+    :param err: OSError the send failed with
+    :return:
+    """
+    # Only warn the first time so every packet from an unreachable sender doesn't flood the log
+    if address not in _failed_acks:
+        _failed_acks.add(address)
+        logger.warning("Can't send acks to '%s' (%s), dropping them", address, err)
+
+
+def _gso_supported(sock):
+    """
+    Function to check if the kernel supports UDP GSO (UDP_SEGMENT) on a socket, setting a GSO size of 0 is a no-op
+    where it is supported and fails where it isn't
+    :param sock: Socket object to check
+    :return: True/False based on if GSO sends can be used
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        sock.setsockopt(socket.IPPROTO_UDP, UDP_SEGMENT, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _receive_worker(sock, gso=False):
+    """
+    Function to run the receive/ack loop on a socket, several of these can drain the same socket in parallel as acks
+    are stateless per packet
+    :param sock: Socket object joined to the multicast group
+    :param gso: Whether acks to the same sender can be coalesced in to one UDP GSO send
     :return:
     """
-    sock = form_sock_receive(group, port)
+    batch = _recvmmsg_batch(RECV_BATCH, RECV_BUF_SIZE)
+    send_batch = _sendmmsg_batch(SEND_BATCH, ACK_SIZE)
 
-    # Receive/respond loop
+    # Receive/respond loop, every datagram queued since the last pass is drained and acked in as few syscalls as we can
+    debug = logger.isEnabledFor(logging.DEBUG)
     while True:
-        print(sys.stderr, 'waiting to receive message')
-        data, address = sock.recvfrom(1024)
+        received = _recvmmsg(sock, batch)
+        if len(received) == 1:
+            # Nothing to coalesce or batch, skip straight to a plain sendto as is usual at low packet rates
+            ack = _make_ack(received[0][0], received[0][1], debug)
+            if ack is not None:
+                try:
+                    sock.sendto(ack[0], ack[1])
+                except OSError as err:
+                    _ack_failed(ack[1], err)
+            continue
+        acks = {}
+        for data, address in received:
+            ack = _make_ack(data, address, debug)
+            if ack is not None:
+                acks.setdefault(ack[1], []).append(ack[0])
+        singles = []
+        for address, dest_acks in acks.items():
+            if gso and len(dest_acks) > 1:
+                # Acks are all ACK_SIZE so the kernel can slice one buffer back in to one datagram per ack, a batch
+                # never holds more than the kernel's 64 segment limit as RECV_BATCH is 64
+                try:
+                    sock.sendmsg([b"".join(dest_acks)], ACK_GSO_CMSG, 0, address)
+                    continue
+                except OSError as err:
+                    # EIO when the outgoing NIC can't checksum offload, which GSO relies on
+                    logger.warning("UDP GSO send failed (%s), falling back to sendmmsg for acks", err)
+                    gso = False
+            singles.extend((ack, address) for ack in dest_acks)
+        for address, err in _sendmmsg(sock, singles, send_batch):
+            _ack_failed(address, err)
 
-        print(sys.stderr, 'received {} bytes from {}'.format(len(data), address))
-        try:
-            data_str = data.decode()
-            packet_no = data_str.split("-")[1]
-            print(sys.stderr, "message: {}".format(data_str))
-            print(sys.stderr, 'sending acknowledgement {} to {}'.format(packet_no, address))
-            sock.sendto(str.encode("ack - {}".format(packet_no)), address)
-        except:
-            print("Multicast data received isn't from the python mc-network-test.py sender!")
-            print("Some other source on address '{}' is sending traffic! Sleeping for 5s".format(address))
-            time.sleep(5)
-
-
-args = parse_args() # Call Parse args to get CLI input
-
-if args.option.lower() == "s":
-    loop_sending_mc(args.address, args.port, args.timeout, args.ttl)
-elif args.option.lower() == "r":
-    receive_mc(args.address, args.port)
-else:
-    print("The wrong option was selected\nYou selected {}\nValid options are: s/S == Send r/R == Receive e.g -o/--option R")
 
+class McProto(asyncio.DatagramProtocol):
+    """
+    Protocol acking MC traffic straight from the event loop's datagram_received callback
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.debug = logger.isEnabledFor(logging.DEBUG)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        ack = _make_ack(data, addr, self.debug)
+        if ack is not None:
+            self.transport.sendto(*ack)
+
+
+def _receive_asyncio(sock):
+    """
+    Function to run the receive/ack loop on an asyncio event loop, uvloop's if it is installed
+    :param sock: Socket object joined to the multicast group
+    :return:
+    """
+    loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(loop.create_datagram_endpoint(McProto, sock=sock))
+        loop.run_forever()
+    finally:
+        loop.close()
+
+
+def handle_sigint(signum, frame):
+    """
+    Function to shut down cleanly on Ctrl-C instead of catching every exception in the send/receive loops
+    :param signum: Signal number, SIGINT
+    :param frame: Current stack frame, unused
+    :return:
+    """
+    logger.info("closing socket")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    args = parse_args() # Call Parse args to get CLI input
+    signal.signal(signal.SIGINT, handle_sigint)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    if args.cpu is not None:
+        pin_to_cpu(args.cpu, args.iface_addr)
+
+    if args.mode == "rate":
+        send = functools.partial(loop_rate_mc, args.address, args.port, args.rate, args.ttl, args.sndbuf,
+                                 args.loopback, args.iface_addr)
+    else:
+        send = functools.partial(loop_sending_mc, args.address, args.port, args.timeout, args.ttl, args.sndbuf,
+                                 args.loopback, args.min_interval, args.iface_addr)
+    dispatch = {
+        "s": send,
+        "r": functools.partial(receive_mc, args.address, args.port, args.workers, args.rcvbuf, args.backend,
+                               args.iface_addr),
+    }
+    dispatch[args.option.lower()]()  # Normalised once, argparse has already limited -o to s/S/r/R
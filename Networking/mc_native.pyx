@@ -0,0 +1,94 @@
+# cython: language_level=3
+"""
+**mc_native.pyx**
+Native receive/ack loop for mc-network-test.py's --backend native, the whole recvfrom/check/sendto loop runs in C
+without the GIL so there is no per packet python dispatch or bytes allocation
+Build it in place next to mc-network-test.py with: python setup.py build_ext --inplace
+"""
+import os
+
+from cpython.exc cimport PyErr_CheckSignals
+from libc.errno cimport errno, EINTR
+from libc.string cimport memcmp, memcpy
+
+
+cdef extern from "<sys/socket.h>" nogil:
+    ctypedef unsigned int socklen_t
+
+    struct sockaddr:
+        pass
+
+    ssize_t recvfrom(int fd, void *buf, size_t n, int flags, sockaddr *addr, socklen_t *addr_len)
+    ssize_t sendto(int fd, const void *buf, size_t n, int flags, const sockaddr *addr, socklen_t addr_len)
+
+
+cdef extern from "<netinet/in.h>" nogil:
+    struct sockaddr_in:
+        unsigned short sin_port
+
+    unsigned short htons(unsigned short)
+
+
+cdef enum:
+    MAX_BUF = 2048
+    MAX_ACK = 64
+
+
+cdef int _serve(int fd, int fd_out, char *buf, size_t bufsize, size_t header_size, const char *prefix,
+                size_t prefix_len, char *ack, size_t ack_prefix_len) noexcept nogil:
+    """
+    Receive/ack loop, only returns when recvfrom fails
+    :return: errno of the failed recvfrom
+    """
+    cdef sockaddr_in src
+    cdef socklen_t src_len
+    cdef ssize_t n
+    cdef unsigned short ack_port
+    while True:
+        src_len = sizeof(src)
+        n = recvfrom(fd, buf, bufsize, 0, <sockaddr *>&src, &src_len)
+        if n < 0:
+            return errno
+        # Skip anything that isn't from a mc-network-test.py sender
+        if <size_t>n < header_size + prefix_len or memcmp(buf + header_size, prefix, prefix_len) != 0:
+            continue
+        # The header ends with the sender's little endian ack port, ack there with the header echoed back verbatim
+        ack_port = (<unsigned char>buf[header_size - 2]) | ((<unsigned char>buf[header_size - 1]) << 8)
+        if ack_port == 0:
+            continue  # Can't be sent to
+        src.sin_port = htons(ack_port)
+        memcpy(ack + ack_prefix_len, buf, header_size)
+        # A failed ack e.g. ENETUNREACH or a firewall's EPERM only loses that ack, keep receiving for other senders
+        sendto(fd_out, ack, ack_prefix_len + header_size, 0, <sockaddr *>&src, sizeof(src))
+
+
+def run_receive(int fd, int fd_out, size_t bufsize, size_t header_size, bytes prefix, bytes ack_prefix):
+    """
+    Function to receive MC traffic and ack it until a signal handler raises or receiving fails, acks that can't be sent
+    are dropped
+    :param fd: File descriptor of the socket joined to the multicast group
+    :param fd_out: File descriptor of the socket to send acks from, usually fd
+    :param bufsize: Max datagram size to receive, capped at 2048
+    :param header_size: Size of mc-network-test.py's HEADER, the ack port is its last 2 bytes
+    :param prefix: mc-network-test.py's PREFIX, expected straight after the header
+    :param ack_prefix: mc-network-test.py's ACK_PREFIX, sent ahead of the echoed header
+    :return:
+    """
+    cdef char buf[MAX_BUF]
+    cdef char ack[MAX_ACK]
+    cdef const char *prefix_ptr = prefix
+    cdef size_t prefix_len = len(prefix)
+    cdef size_t ack_prefix_len = len(ack_prefix)
+    cdef int err
+    if header_size < 2 or ack_prefix_len + header_size > MAX_ACK:
+        raise ValueError("header_size and ack_prefix don't fit in an ack")
+    if bufsize > <size_t>MAX_BUF:
+        bufsize = MAX_BUF
+    memcpy(ack, <const char *>ack_prefix, ack_prefix_len)
+    while True:
+        with nogil:
+            err = _serve(fd, fd_out, buf, bufsize, header_size, prefix_ptr, prefix_len, ack, ack_prefix_len)
+        if err != EINTR:
+            raise OSError(err, os.strerror(err))
+        # Interrupted, give python's signal handlers a chance to run e.g to exit on Ctrl-C
+        PyErr_CheckSignals()
@@ -0,0 +1,346 @@
+# cython: language_level=3
+"""
+**mc_uring.pyx**
+io_uring receive/ack loop for mc-network-test.py's --backend io_uring, needs Linux >= 6.0 and liburing
+A multishot recvmsg has the kernel write each datagram straight in to a registered ring of buffers, and the acks for a
+whole batch of completions are handed to the kernel with a single io_uring_submit_and_wait call
+Build it in place next to mc-network-test.py with: python setup.py build_ext --inplace
+"""
+import os
+import socket
+
+from cpython.exc cimport PyErr_CheckSignals
+from libc.errno cimport EINTR, ENOBUFS, ENOMEM
+from libc.stdlib cimport free, malloc
+from libc.string cimport memcmp, memcpy, memset
+from posix.uio cimport iovec
+
+
+cdef extern from "<sys/socket.h>" nogil:
+    ctypedef unsigned int socklen_t
+
+    struct sockaddr:
+        pass
+
+    struct msghdr:
+        void *msg_name
+        socklen_t msg_namelen
+        iovec *msg_iov
+        size_t msg_iovlen
+        void *msg_control
+        size_t msg_controllen
+        int msg_flags
+
+    enum:
+        MSG_TRUNC
+
+
+cdef extern from "<netinet/in.h>" nogil:
+    struct sockaddr_in:
+        unsigned short sin_port
+
+    unsigned short htons(unsigned short)
+
+
+cdef extern from "<liburing.h>" nogil:
+    struct io_uring:
+        pass
+
+    struct io_uring_sqe:
+        unsigned char flags
+        unsigned short buf_group
+
+    struct io_uring_cqe:
+        unsigned long long user_data
+        int res
+        unsigned int flags
+
+    struct io_uring_buf_ring:
+        pass
+
+    struct __kernel_timespec:
+        long long tv_sec
+        long long tv_nsec
+
+    struct io_uring_recvmsg_out:
+        unsigned int namelen
+        unsigned int controllen
+        unsigned int payloadlen
+        unsigned int flags
+
+    enum:
+        IORING_SETUP_COOP_TASKRUN
+        IORING_SETUP_SINGLE_ISSUER
+        IOSQE_BUFFER_SELECT
+        IORING_CQE_F_BUFFER
+        IORING_CQE_F_MORE
+        IORING_CQE_BUFFER_SHIFT
+
+    int io_uring_queue_init(unsigned entries, io_uring *ring, unsigned flags)
+    void io_uring_queue_exit(io_uring *ring)
+    io_uring_sqe *io_uring_get_sqe(io_uring *ring)
+    int io_uring_submit(io_uring *ring)
+    int io_uring_submit_and_wait(io_uring *ring, unsigned wait_nr)
+    int io_uring_wait_cqe_timeout(io_uring *ring, io_uring_cqe **cqe_ptr, __kernel_timespec *ts)
+    unsigned io_uring_peek_batch_cqe(io_uring *ring, io_uring_cqe **cqes, unsigned count)
+    void io_uring_cq_advance(io_uring *ring, unsigned nr)
+    void io_uring_sqe_set_data64(io_uring_sqe *sqe, unsigned long long data)
+    void io_uring_prep_recvmsg_multishot(io_uring_sqe *sqe, int fd, msghdr *msg, unsigned flags)
+    void io_uring_prep_sendto(io_uring_sqe *sqe, int sockfd, const void *buf, size_t len, int flags,
+                              const sockaddr *addr, socklen_t addrlen)
+    io_uring_buf_ring *io_uring_setup_buf_ring(io_uring *ring, unsigned nentries, int bgid, unsigned flags, int *ret)
+    int io_uring_free_buf_ring(io_uring *ring, io_uring_buf_ring *br, unsigned nentries, int bgid)
+    int io_uring_buf_ring_mask(unsigned ring_entries)
+    void io_uring_buf_ring_add(io_uring_buf_ring *br, void *addr, unsigned len, unsigned short bid, int mask,
+                               int buf_offset)
+    void io_uring_buf_ring_advance(io_uring_buf_ring *br, int count)
+    io_uring_recvmsg_out *io_uring_recvmsg_validate(void *buf, int buf_len, msghdr *msgh)
+    void *io_uring_recvmsg_name(io_uring_recvmsg_out *o)
+    void *io_uring_recvmsg_payload(io_uring_recvmsg_out *o, msghdr *msgh)
+    unsigned int io_uring_recvmsg_payload_length(io_uring_recvmsg_out *o, int buf_len, msghdr *msgh)
+
+
+cdef enum:
+    RING_ENTRIES = 256
+    RECV_BUFS = 128  # Registered receive buffers, must be a power of 2
+    RECV_BUF_SIZE = 2048
+    BGID = 0  # Buffer group id of the receive buffers
+    ACK_SLOTS = 256  # Acks that can be in flight at once
+    MAX_ACK = 64
+
+cdef unsigned long long RECV_TAG = 1ULL << 32  # user_data of the recvmsg completions, send completions carry their slot
+
+
+cdef struct AckSlot:
+    char data[MAX_ACK]
+    sockaddr_in addr
+
+
+cdef struct UringState:
+    io_uring ring
+    io_uring_buf_ring *br
+    char *bufs
+    msghdr recv_msg
+    AckSlot *slots
+    int free_slots[ACK_SLOTS]
+    int nfree
+    int fd
+    int fd_out
+    size_t header_size
+    const char *prefix
+    size_t prefix_len
+    size_t ack_prefix_len
+
+
+cdef io_uring_sqe *_get_sqe(UringState *st) noexcept nogil:
+    cdef io_uring_sqe *sqe = io_uring_get_sqe(&st.ring)
+    if sqe == NULL:
+        # Submission queue full, flush it to the kernel to make room
+        io_uring_submit(&st.ring)
+        sqe = io_uring_get_sqe(&st.ring)
+    return sqe
+
+
+cdef void _arm_recv(UringState *st) noexcept nogil:
+    cdef io_uring_sqe *sqe = _get_sqe(st)
+    io_uring_prep_recvmsg_multishot(sqe, st.fd, &st.recv_msg, 0)
+    sqe.flags |= IOSQE_BUFFER_SELECT
+    sqe.buf_group = BGID
+    io_uring_sqe_set_data64(sqe, RECV_TAG)
+
+
+cdef void _ack(UringState *st, char *buf, int buf_len) noexcept nogil:
+    """
+    Queue an ack for the datagram the kernel wrote in to buf, if it came from a mc-network-test.py sender
+    """
+    cdef io_uring_recvmsg_out *out = io_uring_recvmsg_validate(buf, buf_len, &st.recv_msg)
+    cdef char *payload
+    cdef unsigned int n
+    cdef AckSlot *slot
+    cdef io_uring_sqe *sqe
+    cdef int idx
+    cdef unsigned short ack_port
+    if out == NULL or out.flags & MSG_TRUNC or out.namelen < sizeof(sockaddr_in):
+        return
+    payload = <char *>io_uring_recvmsg_payload(out, &st.recv_msg)
+    n = io_uring_recvmsg_payload_length(out, buf_len, &st.recv_msg)
+    if n < st.header_size + st.prefix_len or memcmp(payload + st.header_size, st.prefix, st.prefix_len) != 0:
+        return
+    # The header ends with the sender's little endian ack port, ack there with the header echoed back verbatim
+    ack_port = (<unsigned char>payload[st.header_size - 2]) | ((<unsigned char>payload[st.header_size - 1]) << 8)
+    if ack_port == 0:
+        return  # Can't be sent to
+    if st.nfree == 0:
+        return  # Every ack slot is still in flight, drop this ack as a full socket buffer would
+    st.nfree -= 1
+    idx = st.free_slots[st.nfree]
+    slot = &st.slots[idx]
+    memcpy(&slot.addr, io_uring_recvmsg_name(out), sizeof(sockaddr_in))
+    slot.addr.sin_port = htons(ack_port)
+    memcpy(slot.data + st.ack_prefix_len, payload, st.header_size)
+    sqe = _get_sqe(st)
+    io_uring_prep_sendto(sqe, st.fd_out, slot.data, st.ack_prefix_len + st.header_size, 0,
+                         <sockaddr *>&slot.addr, sizeof(sockaddr_in))
+    io_uring_sqe_set_data64(sqe, idx)
+
+
+cdef int _serve(UringState *st) noexcept nogil:
+    """
+    Receive/ack loop, only returns on error
+    :return: errno of the failure
+    """
+    cdef io_uring_cqe *cqes[RING_ENTRIES]
+    cdef io_uring_cqe *cqe
+    cdef unsigned count, i
+    cdef int ret, rearm, recycled, bid
+    cdef int mask = io_uring_buf_ring_mask(RECV_BUFS)
+    while True:
+        # Submits the acks queued by the last batch and waits for more completions in one syscall
+        ret = io_uring_submit_and_wait(&st.ring, 1)
+        if ret < 0:
+            return -ret
+        count = io_uring_peek_batch_cqe(&st.ring, cqes, RING_ENTRIES)
+        rearm = 0
+        recycled = 0
+        for i in range(count):
+            cqe = cqes[i]
+            if cqe.user_data != RECV_TAG:
+                st.free_slots[st.nfree] = <int>cqe.user_data
+                st.nfree += 1
+                continue
+            if not cqe.flags & IORING_CQE_F_MORE:
+                rearm = 1  # The kernel ended the multishot recv, e.g. it ran out of buffers
+            if cqe.res < 0 and cqe.res != -ENOBUFS:
+                return -cqe.res
+            if cqe.flags & IORING_CQE_F_BUFFER:
+                bid = cqe.flags >> IORING_CQE_BUFFER_SHIFT
+                _ack(st, st.bufs + bid * RECV_BUF_SIZE, cqe.res)
+                io_uring_buf_ring_add(st.br, st.bufs + bid * RECV_BUF_SIZE, RECV_BUF_SIZE, bid, mask, recycled)
+                recycled += 1
+        io_uring_cq_advance(&st.ring, count)
+        if recycled:
+            io_uring_buf_ring_advance(st.br, recycled)
+        if rearm:
+            _arm_recv(st)
+
+
+cdef int _setup(UringState *st) noexcept nogil:
+    """
+    Set up the ring and its registered receive buffers
+    :return: 0 on success, errno on failure
+    """
+    cdef int ret, i
+    cdef int mask = io_uring_buf_ring_mask(RECV_BUFS)
+    ret = io_uring_queue_init(RING_ENTRIES, &st.ring, IORING_SETUP_COOP_TASKRUN | IORING_SETUP_SINGLE_ISSUER)
+    if ret < 0:
+        # Kernels before 6.0 don't know the setup flags, retry without them
+        ret = io_uring_queue_init(RING_ENTRIES, &st.ring, 0)
+    if ret < 0:
+        return -ret
+    st.br = io_uring_setup_buf_ring(&st.ring, RECV_BUFS, BGID, 0, &ret)
+    if st.br == NULL:
+        io_uring_queue_exit(&st.ring)
+        return -ret
+    st.bufs = <char *>malloc(RECV_BUFS * RECV_BUF_SIZE)
+    if st.bufs == NULL:
+        io_uring_free_buf_ring(&st.ring, st.br, RECV_BUFS, BGID)
+        io_uring_queue_exit(&st.ring)
+        return ENOMEM
+    for i in range(RECV_BUFS):
+        io_uring_buf_ring_add(st.br, st.bufs + i * RECV_BUF_SIZE, RECV_BUF_SIZE, i, mask, i)
+    io_uring_buf_ring_advance(st.br, RECV_BUFS)
+    return 0
+
+
+cdef void _teardown(UringState *st) noexcept nogil:
+    io_uring_free_buf_ring(&st.ring, st.br, RECV_BUFS, BGID)
+    io_uring_queue_exit(&st.ring)
+    free(st.bufs)
+
+
+def supported():
+    """
+    Function to check the running kernel supports the io_uring features the receive loop needs by receiving a datagram
+    sent to ourselves over loopback with a multishot recvmsg, setting up the rings alone already works on 5.19 but
+    multishot recvmsg needs 6.0 and fails its first completion with EINVAL before that
+    :return: True/False based on if run_receive can be used
+    """
+    cdef UringState st
+    cdef io_uring_cqe *cqe = NULL
+    cdef __kernel_timespec ts
+    cdef int ret
+    memset(&st, 0, sizeof(UringState))
+    if _setup(&st) != 0:
+        return False
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            sock.sendto(b"probe", sock.getsockname())
+            st.fd = sock.fileno()
+            st.recv_msg.msg_namelen = sizeof(sockaddr_in)
+            _arm_recv(&st)
+            io_uring_submit(&st.ring)
+            ts.tv_sec = 1
+            ts.tv_nsec = 0
+            ret = io_uring_wait_cqe_timeout(&st.ring, &cqe, &ts)
+            return ret == 0 and cqe.res > 0
+    except OSError:
+        return False  # No loopback to probe over, don't risk the receive loop failing on its first packet
+    finally:
+        # Also cancels the multishot recvmsg if it is still armed
+        _teardown(&st)
+
+
+def run_receive(int fd, int fd_out, size_t header_size, bytes prefix, bytes ack_prefix):
+    """
+    Function to receive MC traffic and ack it until a signal handler raises or an io_uring error occurs, the ring is
+    owned by the calling thread so run one per worker thread
+    :param fd: File descriptor of the socket joined to the multicast group
+    :param fd_out: File descriptor of the socket to send acks from, usually fd
+    :param header_size: Size of mc-network-test.py's HEADER, the ack port is its last 2 bytes
+    :param prefix: mc-network-test.py's PREFIX, expected straight after the header
+    :param ack_prefix: mc-network-test.py's ACK_PREFIX, sent ahead of the echoed header
+    :return:
+    """
+    cdef UringState *st
+    cdef int err, i
+    if header_size < 2 or len(ack_prefix) + header_size > MAX_ACK:
+        raise ValueError("header_size and ack_prefix don't fit in an ack")
+    st = <UringState *>malloc(sizeof(UringState))
+    if st == NULL:
+        raise MemoryError()
+    memset(st, 0, sizeof(UringState))
+    st.slots = <AckSlot *>malloc(ACK_SLOTS * sizeof(AckSlot))
+    if st.slots == NULL:
+        free(st)
+        raise MemoryError()
+    st.fd = fd
+    st.fd_out = fd_out
+    st.header_size = header_size
+    st.prefix = prefix
+    st.prefix_len = len(prefix)
+    st.ack_prefix_len = len(ack_prefix)
+    for i in range(ACK_SLOTS):
+        memcpy(st.slots[i].data, <const char *>ack_prefix, st.ack_prefix_len)
+        st.free_slots[i] = i
+    st.nfree = ACK_SLOTS
+    # Only the source address is wanted back from recvmsg, no control messages
+    st.recv_msg.msg_namelen = sizeof(sockaddr_in)
+    err = _setup(st)
+    if err != 0:
+        free(st.slots)
+        free(st)
+        raise OSError(err, os.strerror(err))
+    try:
+        _arm_recv(st)
+        while True:
+            with nogil:
+                err = _serve(st)
+            if err != EINTR:
+                raise OSError(err, os.strerror(err))
+            # Interrupted, give python's signal handlers a chance to run e.g to exit on Ctrl-C
+            PyErr_CheckSignals()
+    finally:
+        _teardown(st)
+        free(st.slots)
+        free(st)
@@ -0,0 +1,64 @@
+"""
+Builds the optional mc_native and mc_uring extensions used by mc-network-test.py's --backend native and io_uring
+mc_uring needs the liburing >= 2.4 headers and is skipped without them, set LIBURING_DIR to liburing's install prefix if
+it isn't on the system paths
+Build them in place with: python setup.py build_ext --inplace
+"""
+import os
+import re
+
+from setuptools import Extension, setup
+from Cython.Build import cythonize
+
+LIBURING_MIN_VERSION = (2, 4)  # First release with io_uring_setup_buf_ring
+
+
+def liburing_include_dir():
+    """
+    Function to find the liburing headers and check they are new enough to build mc_uring
+    :return: Include directory holding liburing.h, None if liburing's headers are missing or too old
+    """
+    candidates = ["/usr/include", "/usr/local/include"]
+    if os.environ.get("LIBURING_DIR"):
+        candidates.insert(0, os.path.join(os.environ["LIBURING_DIR"], "include"))
+    for include_dir in candidates:
+        if not os.path.exists(os.path.join(include_dir, "liburing.h")):
+            continue
+        try:
+            # Only liburing >= 2.2 ships the version header, anything older is too old anyway
+            with open(os.path.join(include_dir, "liburing", "io_uring_version.h")) as version_file:
+                version_h = version_file.read()
+        except OSError:
+            continue
+        major = re.search(r"IO_URING_VERSION_MAJOR\s+(\d+)", version_h)
+        minor = re.search(r"IO_URING_VERSION_MINOR\s+(\d+)", version_h)
+        if major and minor and (int(major.group(1)), int(minor.group(1))) >= LIBURING_MIN_VERSION:
+            return include_dir
+    return None
+
+
+extensions = [Extension("mc_native", ["mc_native.pyx"], extra_compile_args=["-O3", "-march=native"])]
+
+liburing_include = liburing_include_dir()
+if liburing_include is None:
+    print("liburing >= {}.{} headers not found, skipping mc_uring".format(*LIBURING_MIN_VERSION))
+else:
+    liburing_lib = os.path.join(os.path.dirname(liburing_include), "lib")
+    extensions.append(Extension(
+        "mc_uring", ["mc_uring.pyx"],
+        include_dirs=[liburing_include],
+        library_dirs=[liburing_lib] if os.path.isdir(liburing_lib) else [],
+        libraries=["uring"],
+        extra_compile_args=["-O3", "-march=native"],
+    ))
+
+ext_modules = cythonize(extensions, language_level=3)
+for ext in ext_modules:
+    # Set after cythonize as it drops the flag, so a compile or link failure only skips mc_uring rather than failing
+    # mc_native's build with it
+    ext.optional = ext.name == "mc_uring"
+
+setup(
+    name="mc-native",
+    ext_modules=ext_modules,
+)